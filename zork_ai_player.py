@@ -3,14 +3,31 @@
 Zork AI Player - An AI agent that plays Zork using Claude
 """
 
+import argparse
+import hashlib
 import os
+import re
+import select
+import shutil
 import sys
+import threading
 import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import pexpect
-from anthropic import Anthropic
 import requests
 import json
 
+# Resolved path of the dfrotz binary, looked up once per process
+_FROTZ_PATH = None
+
+def find_frotz():
+    """Locate dfrotz on PATH without spawning a process"""
+    global _FROTZ_PATH
+    if _FROTZ_PATH is None:
+        _FROTZ_PATH = shutil.which('dfrotz')
+    return _FROTZ_PATH
+
 class ZorkPlayer:
     # ANSI color codes
     CYAN = '\033[96m'
@@ -22,7 +39,153 @@ class ZorkPlayer:
     BOLD = '\033[1m'
     RESET = '\033[0m'
     
-    def __init__(self, game_file, api_key=None, max_turns=50, verbose=False, save_file=None, auto_save=True, use_ollama=False, ollama_model="gpt-oss:20b", ollama_url="http://localhost:11434"):
+    # Banner pieces printed every turn, formatted once here
+    SEP = '=' * 70
+    HDR_TURN = f"{GREEN}{BOLD}▶ TURN "
+    PFX_AI = f"{CYAN}{BOLD}🤖 AI Command:{RESET} {CYAN}"
+    PFX_RESPONSE = f"{YELLOW}{BOLD}📜 Game Response:{RESET}"
+    
+    # Frotz's input prompt at the very end of a reply
+    PROMPT_TAIL_RE = re.compile(rb'\n> ?$')
+    # SAVE and RESTORE ask for a filename ("... [zork1.qzl]: "), and SAVE may
+    # then ask "Overwrite existing file? " before the usual prompt
+    FILENAME_TAIL_RE = re.compile(rb': ?$')
+    FILE_REPLY_TAIL_RE = re.compile(rb'\n> ?$|\? ?$')
+    
+    # Score/move counters in the status line change every turn even when
+    # nothing else does
+    STATUS_COUNTERS_RE = re.compile(r'(Score|Moves):\s*-?\d+')
+    
+    # Commands to rotate through when the AI keeps ending up in the same state
+    FALLBACK_COMMANDS = ('LOOK', 'INVENTORY', 'NORTH', 'EAST', 'SOUTH', 'WEST')
+    STATE_CACHE_SIZE = 256
+    
+    # Most locations and items remembered; the least recently seen go first
+    INSIGHT_CACHE_SIZE = 64
+    
+    # Signs the AI is dead: a ghost whose hand passes through things, or the
+    # game's own death banner
+    DEATH_RE = re.compile(r'passes through|ghost|\*+\s*You have died\s*\*+', re.IGNORECASE)
+    
+    # Clean-up of game output before it reaches the AI: colour codes, the
+    # padding in the status line, runs of blank lines, and a length cap
+    # (the end of a long reply is the part that describes where you are)
+    ANSI_RE = re.compile(r'\x1b\[[0-9;]*m')
+    SPACE_RUN_RE = re.compile(r' {3,}')
+    BLANK_LINES_RE = re.compile(r'\n{3,}')
+    MAX_OUTPUT_CHARS = 800
+    
+    # First title-cased line of a game response, e.g. "West of House"
+    ROOM_NAME_RE = re.compile(r'^\s*([A-Z][a-z]+(?: [A-Za-z]+)*)\s*$', re.MULTILINE)
+    
+    # Learning keywords, compiled once so each check is a single regex scan
+    # rather than one substring search per keyword
+    IMPORTANT_RE = re.compile(
+        r"You can't|You need|It's locked|The door is|You see|There is|You find|"
+        r"You take|You drop|You open|You close|You read|You examine|You attack|You die"
+    )
+    ITEM_CUE_RE = re.compile(r'You take|You find|You see')
+    # Whole lines are matched so a single findall over the output replaces
+    # a loop testing each line
+    ITEM_LINE_RE = re.compile(r'^.*(?:you take|you find|you see).*$', re.IGNORECASE | re.MULTILINE)
+    ITEM_WORD_RE = re.compile(r'(?<!\S)(?:take|find|see)\s+(\S+)', re.IGNORECASE)
+    LOCATION_DETAIL_RE = re.compile(r'^.*(?:door|passage|stair|ladder|trap|treasure|monster).*$', re.IGNORECASE | re.MULTILINE)
+    PUZZLE_RE = re.compile(r'door|gate|passage|open', re.IGNORECASE)
+    SOLUTION_RE = re.compile(r'key|lever|button|switch|password', re.IGNORECASE)
+    DIRECTION_RE = re.compile(r'\b(north(?:east|west)?|south(?:east|west)?|east|west|up|down)\b')
+    
+    # Commands that only report on the game without changing it; their
+    # replies are reused until some other command is played
+    QUERY_COMMANDS = {'LOOK', 'L', 'INVENTORY', 'I', 'SCORE'}
+    QUERY_PREFIXES = ('EXAMINE ', 'X ')
+    
+    # Plan-ahead mode: how many commands to ask for per request, how to read
+    # them back, and game replies that mean the rest of the plan is stale
+    PLAN_SIZE = 5
+    PLAN_LINE_RE = re.compile(r'^\s*\d+[.)]\s*(.+?)\s*$', re.MULTILINE)
+    PLAN_FAILURE_RE = re.compile(r"you can't|i don't understand|pitch black|too dark", re.IGNORECASE)
+    PLAN_PROMPT = (
+        f"Instead of a single command, reply with your next {PLAN_SIZE} commands as a "
+        f"numbered list (1. to {PLAN_SIZE}.), one command per line, nothing else."
+    )
+    
+    # Claude models: the large one by default, the small one for routine
+    # turns when routing is on. Those turns are in rooms already mapped,
+    # with nothing in the reply that looks like trouble or a puzzle.
+    CLAUDE_MODEL = "claude-sonnet-4-5-20250929"
+    ROUTINE_MODEL = "claude-haiku-4-5-20251001"
+    
+    # Short primer for Zork I itself: only the rules the AI tends to break
+    # mid-run. The verb and direction lists ride along only after the parser
+    # rejects a command, and the ghost rules only once the AI has died.
+    ZORK1_PROMPT = """You are an AI playing the classic text adventure game Zork I. Explore the Great Underground Empire, solve puzzles, collect treasures and maximize your score.
+
+RULES:
+- Use simple two-word commands like "GO NORTH", "TAKE LAMP", "OPEN DOOR"
+- Keep the lamp and use it - dark areas are deadly
+- Examine things, take useful items, and try other areas when stuck
+- NEVER quit the game, unless you are dead in a ghost world
+
+Each user message is the game's latest output. Output ONLY the next command you want to execute, nothing else. No explanations, just the command."""
+    
+    # Replies from the Infocom parser to a command it couldn't make sense of
+    PARSER_ERROR_RE = re.compile(
+        r"I don't know the word|isn't one I recognize|in a way that I don't understand|"
+        r"There was no verb|I beg your pardon"
+    )
+    PARSER_HELP = (
+        "The game didn't understand that. Common verbs: GO, TAKE, DROP, OPEN, CLOSE, READ, "
+        "EXAMINE, ATTACK, INVENTORY. Directions: NORTH, SOUTH, EAST, WEST, UP, DOWN, NORTHEAST, "
+        "etc. (or N, S, E, W, U, D, NE, etc.). LOOK describes the room again."
+    )
+    # Sent whenever DEATH_RE matches the game output
+    GHOST_HELP = """SPECIAL MECHANICS:
+- If the game says your hand "passes through" an object, it means your character is dead and you are in a ghost world
+- You can't interact with solid objects when dead - you must restart the game
+- Try RESTART command to start over, or QUIT and restart the program if RESTART doesn't work
+- This usually happens when you die in the game - you become a ghost and can't interact with the physical world"""
+    
+    # Full primer, for games without a prompt of their own
+    DEFAULT_PROMPT = """You are an AI playing the classic text adventure game Zork I.
+
+ABOUT ZORK:
+Zork is a text adventure game set in the Great Underground Empire. Your goal is to explore this fantasy world, solve puzzles, collect treasures, and accumulate points. The game responds to natural language commands in the form of verb-noun combinations.
+
+HOW TO PLAY:
+- Use simple two-word commands like "GO NORTH", "TAKE LAMP", "OPEN DOOR"
+- Common verbs: GO, TAKE, DROP, OPEN, CLOSE, READ, EXAMINE, ATTACK, INVENTORY
+- Directions: NORTH, SOUTH, EAST, WEST, UP, DOWN, NORTHEAST, etc. (or N, S, E, W, U, D, NE, etc.)
+- Type INVENTORY (or I) to see what you're carrying
+- Type LOOK to see your current location description again
+- Type EXAMINE [object] to look at something closely
+
+GAME GOALS:
+1. Explore the Great Underground Empire
+2. Solve puzzles to access new areas
+3. Find and collect treasures (usually worth points)
+4. Avoid dangers and survive
+5. Maximize your score
+
+STRATEGY:
+- Map areas mentally as you explore
+- Examine everything carefully
+- Try obvious actions first (take items, open containers)
+- Keep a light source (the lamp is essential in dark areas)
+- Save useful items - you can usually only carry a limited amount
+- If stuck, try examining objects more carefully or revisiting areas
+- NEVER quit the game - always try different approaches when stuck, unless you are dead in a ghost world
+- If you can't progress in one direction, try exploring other areas
+- Use INVENTORY to see what you have and think of creative uses for items
+
+Each user message is the game's latest output. Play strategically and try to make meaningful progress. Output ONLY the next command you want to execute, nothing else. No explanations, just the command."""
+    
+    # System prompt per game, keyed by the game file name without extension
+    PROMPT_TEMPLATES = {
+        "zork1": ZORK1_PROMPT,
+        "default": DEFAULT_PROMPT,
+    }
+    
+    def __init__(self, game_file, api_key=None, max_turns=50, verbose=False, save_file=None, auto_save=True, use_ollama=False, ollama_model="gpt-oss:20b", ollama_url="http://localhost:11434", pipeline=False, resume=None, client=None, throttle=0.0, plan_ahead=False, window=5, route_models=False):
         self.game_file = game_file
         self.max_turns = max_turns
         self.verbose = verbose
@@ -31,12 +194,28 @@ class ZorkPlayer:
         self.use_ollama = use_ollama
         self.ollama_model = ollama_model
         self.ollama_url = ollama_url
+        # Pipeline mode requests the next command while the current turn is
+        # still being printed and saved
+        self.pipeline = pipeline
+        # Background work: pipelined AI requests and autosaves
+        self._pool = ThreadPoolExecutor(max_workers=2)
+        self._save_future = None
+        self._game_lock = threading.Lock()  # one thread talks to Frotz at a time
+        self.resume = resume  # None asks before resuming from an existing save
+        self.throttle = throttle  # seconds to pause after each turn, for watching a run
+        # Plan-ahead mode asks Claude for several commands per request and
+        # plays them from command_queue until the game pushes back
+        self.plan_ahead = plan_ahead
+        self.route_models = route_models  # send routine turns to ROUTINE_MODEL
+        self.command_queue = deque()
         
         if use_ollama:
             self._debug(f"Using Ollama with model: {ollama_model} at {ollama_url}")
+            # One session for all Ollama requests, so they reuse its connections
+            self.http = requests.Session()
             # Test Ollama connection
             try:
-                response = requests.get(f"{ollama_url}/api/tags", timeout=5)
+                response = self.http.get(f"{ollama_url}/api/tags", timeout=5)
                 if response.status_code == 200:
                     self._debug("Ollama connection successful")
                 else:
@@ -47,97 +226,128 @@ class ZorkPlayer:
             self.api_key = api_key or os.environ.get('ANTHROPIC_API_KEY')
             if not self.api_key:
                 raise ValueError("ANTHROPIC_API_KEY not set")
-            self.client = Anthropic(api_key=self.api_key)
+            # Sessions played side by side can share one client and its connections.
+            # The client backs off exponentially on rate limits and overloads
+            # by itself; give it a few more tries than its default of two.
+            if client is None:
+                # Imported here so --help and bad arguments don't load the SDK
+                import httpx
+                from anthropic import Anthropic, DefaultHttpxClient
+                # API connections stay open between turns; httpx would otherwise
+                # close an idle one after 5 seconds, and a slow or throttled turn
+                # pays a new TLS handshake on the next request
+                limits = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60)
+                client = Anthropic(
+                    api_key=self.api_key,
+                    max_retries=5,
+                    http_client=DefaultHttpxClient(limits=limits)
+                )
+            self.client = client
         self.conversation_history = []
+        self.progressive_compression = True  # shorten old game outputs sent to Claude
+        # Conversation window sent to the AI: grows to 2 * window turns, then
+        # drops back to the last window turns so the prompt prefix stays
+        # cacheable. Dropped turns are folded into a rolling digest.
+        self.window = window
+        self.digest = ""  # summary of turns that have left the window
+        self._state_cache = OrderedDict()  # _state_key() -> (command, repeats, chosen by the AI)
+        self._last_state_key = None  # state the latest command was chosen for
+        self._fallback_index = 0
+        self._played_fallback = False  # the latest AI request fell back to a stock command
         self.game_process = None
         self.turn_count = 0
+        self._obs_cache = {}  # (room signature, query command) -> game reply
+        self._room_sig = ""   # first line of the last state-changing reply
+        # Whether a command that isn't a query has been played since the game
+        # was last saved or restored; a fresh game may differ from an old save
+        self._unsaved_changes = True
         
         # Learning system - lightweight knowledge capture
         self.learned_facts = []
-        self.location_insights = {}  # location -> insights
-        self.item_insights = {}      # item -> insights
+        self.location_insights = OrderedDict()  # location -> insights, oldest first
+        self.item_insights = OrderedDict()      # item -> insights, oldest first
         self.puzzle_solutions = {}   # puzzle -> solution
         self.learning_file = None
+        self._last_learning_hash = None  # digest of the last learning file written
+        self._learning_context = None    # rendered get_learning_context(), None once stale
         
         # Map system - lightweight navigation data
         self.location_map = {}       # location -> connections
         self.location_names = {}     # location -> short name
         self.visited_locations = set()  # track visited places
+        self.recent_locations = deque(maxlen=5)  # last places visited, newest last
         self.current_location = None
+        self._new_location = False  # current_location wasn't visited before this turn
         
         # Set up save file path
+        game_name = os.path.splitext(os.path.basename(game_file))[0]
         if not self.save_file:
-            game_name = os.path.splitext(os.path.basename(game_file))[0]
             save_dir = os.path.join(os.path.dirname(game_file), 'saves')
             os.makedirs(save_dir, exist_ok=True)
             # Frotz uses .qzl extension for Quetzal save format
             self.save_file = os.path.join(save_dir, f'{game_name}_autosave.qzl')
+        else:
+            save_dir = os.path.dirname(self.save_file) or '.'
+        
+        # Frotz may or may not add .qzl to the name we give it
+        self._save_candidates = (self.save_file, self.save_file + '.qzl')
+        self._resolved_save_path = None  # whichever candidate Frotz wrote last
+        # The conversation is saved next to the game, so a resumed game
+        # picks up with what the AI already knew
+        self.history_file = self.save_file + '.history.json'
         
         # Set up learning file path
         self.learning_file = os.path.join(save_dir, f'{game_name}_learning.json')
         
+        # Pick the prompt for this game once; the rules never change, so the
+        # cached system block is built once too
+        self.system_prompt = self.PROMPT_TEMPLATES.get(game_name.lower(), self.PROMPT_TEMPLATES["default"])
+        self._static_system_block = {
+            "type": "text",
+            "text": self.system_prompt,
+            "cache_control": {"type": "ephemeral"}
+        }
+        
     def _debug(self, message):
         """Print debug message if verbose mode is enabled"""
         if self.verbose:
             print(f"{self.GREY}{message}{self.RESET}", flush=True)
-        
-        # System prompt explaining Zork and how to play
-        self.system_prompt = """You are an AI playing the classic text adventure game Zork I.
-
-ABOUT ZORK:
-Zork is a text adventure game set in the Great Underground Empire. Your goal is to explore this fantasy world, solve puzzles, collect treasures, and accumulate points. The game responds to natural language commands in the form of verb-noun combinations.
-
-HOW TO PLAY:
-- Use simple two-word commands like "GO NORTH", "TAKE LAMP", "OPEN DOOR"
-- Common verbs: GO, TAKE, DROP, OPEN, CLOSE, READ, EXAMINE, ATTACK, INVENTORY
-- Directions: NORTH, SOUTH, EAST, WEST, UP, DOWN, NORTHEAST, etc. (or N, S, E, W, U, D, NE, etc.)
-- Type INVENTORY (or I) to see what you're carrying
-- Type LOOK to see your current location description again
-- Type EXAMINE [object] to look at something closely
-
-GAME GOALS:
-1. Explore the Great Underground Empire
-2. Solve puzzles to access new areas
-3. Find and collect treasures (usually worth points)
-4. Avoid dangers and survive
-5. Maximize your score
-
-STRATEGY:
-- Map areas mentally as you explore
-- Examine everything carefully
-- Try obvious actions first (take items, open containers)
-- Keep a light source (the lamp is essential in dark areas)
-- Save useful items - you can usually only carry a limited amount
-- If stuck, try examining objects more carefully or revisiting areas
-- NEVER quit the game - always try different approaches when stuck, unless you are dead in a ghost world
-- If you can't progress in one direction, try exploring other areas
-- Use INVENTORY to see what you have and think of creative uses for items
-
-SPECIAL MECHANICS:
-- If the game says your hand "passes through" an object, it means your character is dead and you are in a ghost world
-- You can't interact with solid objects when dead - you must restart the game
-- Try RESTART command to start over, or QUIT and restart the program if RESTART doesn't work
-- This usually happens when you die in the game - you become a ghost and can't interact with the physical world
-
-Play strategically and try to make meaningful progress. Output ONLY the next command you want to execute, nothing else. No explanations, just the command."""
-
+    
     def start_game(self):
         """Start the Frotz process using pexpect"""
         self._debug("Attempting to start Frotz with pexpect...")
         try:
-            # Spawn frotz with pexpect - it handles pseudo-terminals automatically
+            frotz_path = find_frotz()
+            if not frotz_path:
+                raise FileNotFoundError('dfrotz')
+            
+            # Spawn frotz with pexpect - it handles pseudo-terminals automatically,
+            # so Frotz flushes every line as it would on a real terminal.
+            # Passing argv directly keeps paths with spaces intact.
             self.game_process = pexpect.spawn(
-                f'dfrotz {self.game_file}',
+                frotz_path,
+                [self.game_file],
                 encoding='utf-8',
-                timeout=30
+                timeout=30,
+                maxread=4096,  # read long room descriptions in a few large chunks
+                # Prompts always end the output, so expect() only needs to
+                # scan the tail instead of the whole buffer on every read
+                searchwindowsize=256
             )
+            # pexpect sleeps 50ms before every send by default; Frotz is always
+            # waiting at its prompt by the time anything is sent
+            self.game_process.delaybeforesend = None
             
-            self._debug("Waiting for initial game prompt...")
-            # Wait for the initial '>' prompt
-            self.game_process.expect('>', timeout=10)
+            # RESTART waits on the same patterns every time; compile them
+            # against this spawn once instead of on every expect().
+            # "Do you wish to restart?" (Zork I) or "Are you sure you want to restart?"
+            self._restart_prompt_pats = self.game_process.compile_pattern_list(
+                ['(?i)restart\\?', pexpect.TIMEOUT]
+            )
             
-            # Get all the text that appeared before the prompt
-            initial_output = self.game_process.before
+            self._debug("Waiting for initial game prompt...")
+            # Get all the text that appears before the initial '>' prompt
+            initial_output = self._read_until_prompt(timeout=10)
             
             self._debug(f"Captured {len(initial_output)} characters of initial output")
             return initial_output
@@ -153,99 +363,198 @@ Play strategically and try to make meaningful progress. Output ONLY the next com
             print(f"Error starting game: {e}")
             sys.exit(1)
     
-    def _read_game_output(self, timeout=5, wait_for_prompt=True):
-        """Read output from the game until we see the prompt"""
-        output = []
-        end_time = time.time() + timeout
-        last_char_time = time.time()
-        
-        self._debug(f"Reading game output (timeout: {timeout}s, wait_for_prompt: {wait_for_prompt})...")
-        
-        while time.time() < end_time:
-            # Check if process is still alive
-            if self.game_process.poll() is not None:
-                self._debug("Game process ended")
+    def _read_until_prompt(self, timeout, tail_re=None):
+        """Read the game's reply straight from the pty up to the '>' prompt, or another tail_re"""
+        # One large read per burst of output and a prompt check on just its
+        # last few bytes, instead of pexpect's small reads and rescans.
+        # Start from anything pexpect already buffered; the prompt ends the
+        # reply, so nothing is left over for later expect() calls.
+        if tail_re is None:
+            tail_re = self.PROMPT_TAIL_RE
+        fd = self.game_process.child_fd
+        buf = bytearray(self.game_process.buffer.encode('utf-8'))
+        self.game_process.buffer = ''
+        deadline = time.monotonic() + timeout
+        
+        while True:
+            prompt = tail_re.search(buf, max(0, len(buf) - 8))
+            if prompt:
                 break
-            
-            # Use select to check if data is available (Unix-like systems)
-            if sys.platform != 'win32':
-                ready, _, _ = select.select([self.game_process.stdout], [], [], 0.1)
-                if ready:
-                    try:
-                        char = self.game_process.stdout.read(1)
-                        if char:
-                            output.append(char)
-                            last_char_time = time.time()
-                    except:
-                        break
-                else:
-                    # No data available right now
-                    if output and wait_for_prompt:
-                        # Check if we have a prompt at the end
-                        output_str = ''.join(output)
-                        # Look for prompt pattern: newline followed by > and then nothing/whitespace
-                        if output_str.rstrip().endswith('\n>') or output_str.endswith('> '):
-                            self._debug("Found prompt pattern, stopping read")
-                            break
-                    
-                    # If no new data for 2 seconds, stop
-                    if output and (time.time() - last_char_time) > 2.0:
-                        self._debug("No new data for 2s, stopping")
-                        break
-            else:
-                # Windows fallback
-                try:
-                    import threading
-                    def read_line():
-                        return self.game_process.stdout.readline()
-                    
-                    thread = threading.Thread(target=read_line)
-                    thread.daemon = True
-                    thread.start()
-                    thread.join(0.1)
-                    
-                    if thread.is_alive():
-                        time.sleep(0.1)
-                        continue
-                except:
-                    break
-        
-        result = ''.join(output).strip()
-        self._debug(f"Read {len(result)} characters")
-        return result
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.game_process.buffer = buf.decode('utf-8', 'replace')
+                raise pexpect.TIMEOUT(f"No prompt after {timeout}s")
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                continue
+            try:
+                chunk = os.read(fd, 65536)
+            except OSError:
+                chunk = b''  # the pty raises EIO once the game has exited
+            if not chunk:
+                raise pexpect.EOF("Game process ended")
+            buf += chunk
+        
+        return buf[:prompt.start()].decode('utf-8', 'replace')
     
     def send_command(self, command):
         """Send a command to the game and get response"""
         if self.game_process and self.game_process.isalive():
-            try:
-                self._debug(f"Sending command: {command}")
+            query = command.strip().upper()
+            is_query = query in self.QUERY_COMMANDS or query.startswith(self.QUERY_PREFIXES)
+            if is_query:
+                cached = self._obs_cache.get((self._room_sig, query))
+                if cached is not None:
+                    self._debug(f"Reusing reply to {query} - nothing has changed since")
+                    return cached
+            
+            # An autosave may be running on another thread
+            with self._game_lock:
+                try:
+                    # Skip building debug strings on every turn unless they'll be shown
+                    if self.verbose:
+                        self._debug(f"Sending command: {command}")
                 
-                # Send the command
-                self.game_process.sendline(command)
+                    # Send the command
+                    self.game_process.sendline(command)
                 
-                # Wait for the next prompt
-                self.game_process.expect('>', timeout=10)
+                    # Get everything that appears before the next prompt
+                    response = self._read_until_prompt(timeout=10)
                 
-                # Get everything that appeared before the prompt
-                response = self.game_process.before
+                    if self.verbose:
+                        self._debug(f"Got response: {len(response)} characters")
+                    response = response.strip()
                 
-                self._debug(f"Got response: {len(response)} characters")
-                return response.strip()
+                    # Any other command may have changed the game, so older
+                    # query replies are stale
+                    if is_query:
+                        self._obs_cache[(self._room_sig, query)] = response
+                    else:
+                        self._obs_cache.clear()
+                        self._unsaved_changes = True
+                        lines = [line.strip() for line in response.split('\n') if line.strip()]
+                        # The first line is the echoed command
+                        self._room_sig = lines[1] if len(lines) > 1 else response
+                    return response
                 
-            except pexpect.TIMEOUT:
-                self._debug("Timeout waiting for response")
-                return "Error: Game did not respond in time"
-            except Exception as e:
-                self._debug(f"Error sending command: {e}")
-                return f"Error sending command: {e}"
+                except pexpect.TIMEOUT:
+                    self._debug("Timeout waiting for response")
+                    return "Error: Game did not respond in time"
+                except Exception as e:
+                    self._debug(f"Error sending command: {e}")
+                    return f"Error sending command: {e}"
         return "Game process not running"
     
     def get_ai_command(self, game_output):
         """Get next command from AI (Claude or Ollama)"""
-        if self.use_ollama:
-            return self._get_ollama_command(game_output)
+        # Seeing the exact same game state again means the last command did
+        # nothing. Replay it once without asking the AI, then rotate through
+        # simple fallback commands instead of looping.
+        key = self._state_key(game_output)
+        self._last_state_key = key
+        # The state key is taken from the output as played; the AI and the
+        # conversation only get the compacted text
+        game_output = self._compact_output(game_output)
+        cached = self._state_cache.get(key)
+        if cached:
+            command, repeats, chosen = cached
+            if repeats:
+                command = self.FALLBACK_COMMANDS[self._fallback_index % len(self.FALLBACK_COMMANDS)]
+                self._fallback_index += 1
+                self._debug(f"State repeated again, trying fallback: {command}")
+                self._state_cache[key] = (command, 0, False)
+            else:
+                self._debug(f"State seen before, reusing command: {command}")
+                self._state_cache[key] = (command, 1, chosen)
+            self._state_cache.move_to_end(key)
+            self._record_turn(game_output, command)
+            self._advance_window()
+            return command
+        
+        self._played_fallback = False
+        if self.command_queue:
+            command = self.command_queue.popleft()
+            self._debug(f"Playing planned command: {command} ({len(self.command_queue)} left)")
+            self._record_turn(game_output, command)
+        elif self.use_ollama:
+            command = self._get_ollama_command(game_output)
         else:
-            return self._get_claude_command(game_output)
+            command = self._get_claude_command(game_output)
+        
+        # A stock command played because the request failed isn't a choice
+        # worth replaying; the AI gets asked again next time
+        if not self._played_fallback:
+            self._state_cache[key] = (command, 0, True)
+            if len(self._state_cache) > self.STATE_CACHE_SIZE:
+                self._state_cache.popitem(last=False)
+        self._advance_window()
+        return command
+    
+    def _advance_window(self):
+        """Fold the oldest turns into the digest once the window reaches 2 * window turns"""
+        # Truncating only in steps keeps every request between resets an exact
+        # extension of the one before it, which is what the prompt cache needs
+        if len(self.conversation_history) < 4 * self.window:
+            return
+        cut = len(self.conversation_history) - 2 * self.window
+        self._update_digest(self.conversation_history[:cut])
+        del self.conversation_history[:cut]
+        self._debug(f"Conversation window reset to the last {len(self.conversation_history)} messages")
+    
+    def _update_digest(self, messages):
+        """Fold turns leaving the window into the running summary so early discoveries aren't lost"""
+        transcript = "\n".join(
+            f"{'GAME' if msg['role'] == 'user' else 'COMMAND'}: {msg['content']}" for msg in messages
+        )
+        # Each digest folds in the one before it, so it covers the whole game
+        # rather than only the turns dropped last
+        prompt = "Summarize the adventure so far in at most 200 tokens, preserving room names, key items and unlocked paths.\n"
+        if self.digest:
+            prompt += f"\nSummary so far:\n{self.digest}\n"
+        prompt += f"\nLatest turns:\n{transcript}"
+        self._debug(f"Summarizing {len(messages)} old messages...")
+        try:
+            if self.use_ollama:
+                response = self.http.post(
+                    f"{self.ollama_url}/api/generate",
+                    json={"model": self.ollama_model, "prompt": prompt, "stream": False},
+                    timeout=30
+                )
+                response.raise_for_status()
+                self.digest = response.json().get("response", "").strip()
+            else:
+                response = self.client.messages.create(
+                    model=self.ROUTINE_MODEL,
+                    max_tokens=300,
+                    messages=[{"role": "user", "content": prompt}]
+                )
+                self.digest = response.content[0].text.strip()
+        except Exception as e:
+            # Keep the previous digest; the window still has to move on
+            self._debug(f"History summary failed: {e}")
+    
+    def _state_key(self, game_output):
+        """Hash the prompt, a game output and the last three commands for the state cache"""
+        # Turn counters are ignored so the same room hashes the same on any move.
+        # The recent commands tell apart arriving somewhere from being stuck there,
+        # and the prompt keeps a saved cache from outliving prompt changes.
+        state = self.STATUS_COUNTERS_RE.sub(r'\1:', game_output.strip())
+        recent = [msg["content"] for msg in self.conversation_history[-6:] if msg["role"] == "assistant"]
+        key = hashlib.blake2b(self.system_prompt.encode(), digest_size=8)
+        key.update(state.encode())
+        key.update("|".join(recent).encode())
+        return key.hexdigest()
+    
+    def _record_turn(self, game_output, command):
+        """Add a game output and the command answering it to the conversation"""
+        self.conversation_history.append({
+            "role": "user",
+            "content": game_output
+        })
+        self.conversation_history.append({
+            "role": "assistant",
+            "content": command
+        })
     
     def _get_claude_command(self, game_output):
         """Get next command from Claude"""
@@ -254,27 +563,69 @@ Play strategically and try to make meaningful progress. Output ONLY the next com
         # Get learning context
         learning_context = self.get_learning_context()
         
-        # Create enhanced prompt with learning
-        enhanced_prompt = self.system_prompt
-        if learning_context:
-            enhanced_prompt += f"\n\nPREVIOUS KNOWLEDGE:\n{learning_context}\n\nUse this knowledge to make better decisions."
-        
         # Add game output to conversation
         self.conversation_history.append({
             "role": "user",
-            "content": f"Game output:\n{game_output}\n\nWhat's your next command?"
+            "content": game_output
         })
         
-        # Get response from Claude
-        response = self.client.messages.create(
-            model="claude-sonnet-4-5-20250929",
-            max_tokens=150,
-            system=enhanced_prompt,
-            messages=self.conversation_history
-        )
+        messages = self._build_cached_messages(learning_context)
+        plan = self.plan_ahead
+        if plan:
+            # After the cache breakpoint, like the learning context
+            messages[-1]["content"].append({"type": "text", "text": self.PLAN_PROMPT})
+        # Also after the breakpoint, so the system prompt stays cached
+        for help_text in self._situational_help(game_output):
+            messages[-1]["content"].append({"type": "text", "text": help_text})
+        
+        model = self._pick_model(game_output)
+        
+        # Stream the response from Claude and stop at the end of the first
+        # line - the command is all we need, so don't wait for the rest
+        with self.client.messages.stream(
+            model=model,
+            max_tokens=400 if plan else 24,
+            # The API rejects whitespace-only stop sequences; the stream loop
+            # below already cuts a single command at the first newline, and
+            # a plan ends where an extra item would start
+            stop_sequences=[f"{self.PLAN_SIZE + 1}."] if plan else ["."],
+            system=[self._static_system_block],
+            messages=messages
+        ) as stream:
+            text = ""
+            for chunk in stream.text_stream:
+                text += chunk
+                if plan:
+                    # Stop once PLAN_SIZE complete lines are in, whatever follows
+                    complete = text[:text.rfind('\n') + 1]
+                    if len(self.PLAN_LINE_RE.findall(complete)) >= self.PLAN_SIZE:
+                        break
+                # max_tokens and the "." stop already keep the line short, so
+                # there's no length cap that could cut a long command in half
+                elif '\n' in text.lstrip():
+                    break  # leaving the block closes the stream
+            usage = stream.current_message_snapshot.usage
         
-        command = response.content[0].text.strip()
+        if self.verbose:
+            self._debug(f"Tokens ({model}): {usage.input_tokens} in, {usage.cache_read_input_tokens or 0} cached, {usage.cache_creation_input_tokens or 0} cache write")
         
+        planned = self.PLAN_LINE_RE.findall(text) if plan else []
+        if planned:
+            command = planned[0]
+            self.command_queue.extend(planned[1:self.PLAN_SIZE])
+            self._debug(f"Planned ahead: {planned[1:self.PLAN_SIZE]}")
+        else:
+            lines = text.strip().splitlines()
+            command = lines[0].strip() if lines else ""
+        if not command:
+            # A reply cut at the "." stop sequence, or only whitespace, has no
+            # command; an empty assistant message would make the API reject
+            # every later request, so send a fallback command instead
+            command = self.FALLBACK_COMMANDS[self._fallback_index % len(self.FALLBACK_COMMANDS)]
+            self._fallback_index += 1
+            self._played_fallback = True
+            self._debug(f"Claude returned no command, trying fallback: {command}")
+
         # Add AI's command to conversation
         self.conversation_history.append({
             "role": "assistant",
@@ -283,6 +634,109 @@ Play strategically and try to make meaningful progress. Output ONLY the next com
         
         return command
     
+    def _situational_help(self, game_output):
+        """Return the rules that only matter for this game output: parser help, ghost world"""
+        # Kept out of the system prompt so it stays short and unchanged; the
+        # rules are sent only on the turns that need them
+        help_texts = []
+        if self.PARSER_ERROR_RE.search(game_output):
+            help_texts.append(self.PARSER_HELP)
+        if self.DEATH_RE.search(game_output):
+            help_texts.append(self.GHOST_HELP)
+        return help_texts
+    
+    def _pick_model(self, game_output):
+        """Choose the Claude model for a turn"""
+        # A refused command, an error, darkness, death or a likely puzzle goes
+        # to the large model, so a mistake by the small one is corrected on
+        # the very next turn. So does a room seen for the first time, even
+        # though extract_learning has already put it on the map.
+        if (self.route_models
+                and not self._new_location
+                and self.current_location in self.location_map
+                and not self.PLAN_FAILURE_RE.search(game_output)
+                and not self.PARSER_ERROR_RE.search(game_output)
+                and not self.DEATH_RE.search(game_output)
+                and not self.SOLUTION_RE.search(game_output)):
+            return self.ROUTINE_MODEL
+        return self.CLAUDE_MODEL
+    
+    def _build_cached_messages(self, learning_context):
+        """Copy the conversation window for the API with prompt cache breakpoints on the last two turns"""
+        # The breakpoint moves forward each turn, so the next request reads the
+        # whole history prefix from cache. Learning context changes between
+        # turns, so it rides after the breakpoint instead of in the system prompt.
+        if self.progressive_compression:
+            messages = self._compress_history()
+        else:
+            messages = list(self.conversation_history)
+        if self.digest:
+            # The digest only changes on a window reset, so it's part of the
+            # cached prefix like everything else in the window
+            first = messages[0]
+            messages[0] = {"role": "user", "content": f"STORY SO FAR:\n{self.digest}\n\n{first['content']}"}
+        
+        # Mark the previous game output too, so the prefix up to it is read
+        # from cache even when the newest turn is the first after a reset
+        user_turns = [i for i, msg in enumerate(messages) if msg["role"] == "user"]
+        if len(user_turns) > 1:
+            prev = messages[user_turns[-2]]
+            messages[user_turns[-2]] = {"role": "user", "content": [{
+                "type": "text",
+                "text": prev["content"],
+                "cache_control": {"type": "ephemeral"}
+            }]}
+        
+        last = messages[-1]
+        content = [{
+            "type": "text",
+            "text": last["content"],
+            "cache_control": {"type": "ephemeral"}
+        }]
+        if learning_context:
+            content.append({
+                "type": "text",
+                "text": f"PREVIOUS KNOWLEDGE:\n{learning_context}\n\nUse this knowledge to make better decisions."
+            })
+        messages[-1] = {"role": last["role"], "content": content}
+        return messages
+    
+    def _compress_history(self):
+        """Copy the conversation with game outputs from before the last window reset cut to one line"""
+        # Only the API copy is shortened; conversation_history keeps the full text.
+        # After a reset the window starts with the turns carried over, so the
+        # compressed prefix is the same on every request until the next one.
+        cutoff = 2 * self.window if self.digest else 0
+        
+        messages = []
+        for i, msg in enumerate(self.conversation_history):
+            if i < cutoff and msg["role"] == "user":
+                msg = {"role": "user", "content": self._summarize_game_output(msg["content"])}
+            messages.append(msg)
+        return messages
+    
+    def _compact_output(self, text):
+        """Strip a game output down to the text the AI needs to read"""
+        lines = []
+        for line in self.ANSI_RE.sub('', text).split('\n'):
+            line = self.SPACE_RUN_RE.sub('  ', line.rstrip())
+            if line and lines and line == lines[-1]:
+                continue  # the same header printed twice
+            lines.append(line)
+        text = self.BLANK_LINES_RE.sub('\n\n', '\n'.join(lines)).strip()
+        if len(text) > self.MAX_OUTPUT_CHARS:
+            text = "…" + text[-self.MAX_OUTPUT_CHARS:]
+        return text
+    
+    def _summarize_game_output(self, content):
+        """Reduce an old game output message to room name, size and last line"""
+        body = content.strip()
+        match = self.ROOM_NAME_RE.search(body)
+        room = match.group(1) if match else "?"
+        lines = [line.strip() for line in body.split('\n') if line.strip()]
+        last_line = lines[-1][:60] if lines else ""
+        return f"[game] {room} ({len(body)} chars) → {last_line}"
+    
     def _get_ollama_command(self, game_output):
         """Get next command from Ollama"""
         self._debug(f"Requesting command from Ollama ({self.ollama_model})...")
@@ -295,24 +749,31 @@ Play strategically and try to make meaningful progress. Output ONLY the next com
         if learning_context:
             enhanced_prompt += f"\n\nPREVIOUS KNOWLEDGE:\n{learning_context}\n\nUse this knowledge to make better decisions."
         
-        # Build conversation context for Ollama
-        conversation_text = enhanced_prompt + "\n\n"
-        
-        # Add conversation history
-        for msg in self.conversation_history[-10:]:  # Keep last 10 messages to avoid token limits
-            if msg["role"] == "user":
-                conversation_text += f"User: {msg['content']}\n"
-            else:
-                conversation_text += f"Assistant: {msg['content']}\n"
+        # Build conversation context for Ollama, collected in a list and
+        # joined once rather than grown a piece at a time
+        parts = [enhanced_prompt, "\n\n"]
+        if self.digest:
+            parts.append(f"STORY SO FAR:\n{self.digest}\n\n")
+        
+        # Add the same append-only window Claude gets, so the prompt text only
+        # changes at its end between window resets and Ollama can reuse its
+        # cached prefix
+        parts += [
+            f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}\n"
+            for msg in self.conversation_history
+        ]
         
         # Add current game output
-        conversation_text += f"User: Game output:\n{game_output}\n\nWhat's your next command?\n"
+        parts.append(f"User: Game output:\n{game_output}\n\n")
+        parts += [f"{help_text}\n\n" for help_text in self._situational_help(game_output)]
+        parts.append("What's your next command?\n")
+        conversation_text = "".join(parts)
         
         # Prepare Ollama request
         ollama_request = {
             "model": self.ollama_model,
             "prompt": conversation_text,
-            "stream": False,
+            "stream": True,
             "options": {
                 "temperature": 0.7,
                 "top_p": 0.9,
@@ -321,107 +782,169 @@ Play strategically and try to make meaningful progress. Output ONLY the next com
         }
         
         try:
-            response = requests.post(
+            # Stream the reply and stop at the end of its first line, as with
+            # Claude; closing the response early also stops the generation
+            with self.http.post(
                 f"{self.ollama_url}/api/generate",
                 json=ollama_request,
-                timeout=30
-            )
-            response.raise_for_status()
+                timeout=30,
+                stream=True
+            ) as response:
+                response.raise_for_status()
+                text = ""
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if "error" in chunk:
+                        # Ollama reports a failure mid-stream as an error
+                        # chunk rather than an HTTP status
+                        self._debug(f"Ollama returned an error: {chunk['error']}")
+                        self._played_fallback = True
+                        return "LOOK"  # Fallback command
+                    text += chunk.get("response", "")
+                    if chunk.get("done") or '\n' in text.lstrip():
+                        break
             
-            result = response.json()
-            command = result.get("response", "").strip()
+            lines = text.strip().splitlines()
+            command = lines[0].strip() if lines else ""
+            if not command:
+                self._debug("Ollama returned no command")
+                self._played_fallback = True
+                return "LOOK"  # Fallback command
             
-            # Add AI's command to conversation
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": command
-            })
+            # Add the game output and AI's command to conversation
+            self._record_turn(game_output, command)
             
             return command
             
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ValueError) as e:
             self._debug(f"Ollama request failed: {e}")
+            self._played_fallback = True
             return "LOOK"  # Fallback command
     
     def extract_learning(self, game_output, command, response):
         """Extract key learning from game interaction"""
-        # Look for important patterns in the game output
-        important_patterns = [
-            "You can't", "You need", "It's locked", "The door is", "You see",
-            "There is", "You find", "You take", "You drop", "You open",
-            "You close", "You read", "You examine", "You attack", "You die"
-        ]
+        # Split and lowercase the output once for all of the helpers below
+        lines = game_output.split('\n')
+        lower_output = game_output.lower()
         
         # Extract location information and update map
         if "You are in" in game_output or "You are at" in game_output:
-            location = self._extract_location(game_output)
+            location = self._extract_location(lines)
             if location:
-                self._debug(f"📍 Location detected: '{location}'")
-                self.current_location = location
-                self.visited_locations.add(location)
-                self.location_insights[location] = self._summarize_location(game_output)
-                self._update_location_map(game_output, location)
-                self._debug(f"🗺️  Map updated. Total locations: {len(self.visited_locations)}")
+                if self.verbose:
+                    self._debug(f"📍 Location detected: '{location}'")
+                self._note_visit(location)
+                self._lru_put(self.location_insights, location, self._summarize_location(game_output))
+                self._update_location_map(lower_output, location)
+                if self.verbose:
+                    self._debug(f"🗺️  Map updated. Total locations: {len(self.visited_locations)}")
             else:
                 self._debug("⚠️  Location extraction failed")
         else:
             # Try to extract location even without "You are in/at" pattern
-            location = self._extract_location(game_output)
+            location = self._extract_location(lines)
             if location:
-                self._debug(f"📍 Location detected (alternative): '{location}'")
-                self.current_location = location
-                self.visited_locations.add(location)
-                self.location_insights[location] = self._summarize_location(game_output)
-                self._update_location_map(game_output, location)
-                self._debug(f"🗺️  Map updated. Total locations: {len(self.visited_locations)}")
+                if self.verbose:
+                    self._debug(f"📍 Location detected (alternative): '{location}'")
+                self._note_visit(location)
+                self._lru_put(self.location_insights, location, self._summarize_location(game_output))
+                self._update_location_map(lower_output, location)
+                if self.verbose:
+                    self._debug(f"🗺️  Map updated. Total locations: {len(self.visited_locations)}")
         
         # Extract item information
-        if any(pattern in game_output for pattern in ["You take", "You find", "You see"]):
+        if self.ITEM_CUE_RE.search(game_output):
             items = self._extract_items(game_output)
+            lower_lines = lower_output.split('\n')
             for item in items:
-                self.item_insights[item] = self._summarize_item(game_output, item)
+                self._lru_put(self.item_insights, item, self._summarize_item(lines, lower_lines, item))
+        
+        # A command the game refused shouldn't be replayed from the state
+        # cache; ask the AI again next time this state comes up
+        if "You can't" in response and self._state_cache.pop(self._last_state_key, None):
+            self._debug(f"Forgetting cached command for this state: {command}")
         
         # Extract puzzle solutions
         if "You can't" in response and "You need" in game_output:
             puzzle = self._identify_puzzle(game_output)
             if puzzle:
-                self.puzzle_solutions[puzzle] = self._extract_solution_hint(game_output)
-        
-        # Extract general facts
-        if any(pattern in game_output for pattern in important_patterns):
-            fact = self._extract_fact(game_output, command, response)
+                solution = self._extract_solution_hint(lines)
+                if self.puzzle_solutions.get(puzzle) != solution:
+                    self.puzzle_solutions[puzzle] = solution
+                    self._learning_context = None
+        
+        # Extract general facts; the phrases found here are handed on so
+        # _extract_fact doesn't search the text again
+        phrases = set(self.IMPORTANT_RE.findall(game_output))
+        if phrases:
+            fact = self._extract_fact(command, response, phrases)
             if fact:
                 self.learned_facts.append(fact)
+                self._learning_context = None
     
-    def _extract_location(self, game_output):
-        """Extract current location from game output"""
-        lines = game_output.split('\n')
-        self._debug(f"🔍 Extracting location from {len(lines)} lines")
+    def _note_visit(self, location):
+        """Record a location as the current one, visited and the most recent place"""
+        # Taken before this turn's learning adds the room to the map, so
+        # model routing can tell a first visit from a return
+        self._new_location = location not in self.visited_locations
+        self.visited_locations.add(location)
+        if location == self.current_location and self.recent_locations and self.recent_locations[-1] == location:
+            return  # still in the same place
+        self.current_location = location
+        self._learning_context = None
+        if location in self.recent_locations:
+            self.recent_locations.remove(location)
+        self.recent_locations.append(location)
+    
+    def _lru_put(self, insights, key, value):
+        """Store an insight as the most recent one, dropping the oldest past the cap"""
+        if insights and next(reversed(insights)) == key and insights[key] == value:
+            return  # already the newest, unchanged
+        self._learning_context = None
+        insights[key] = value
+        insights.move_to_end(key)
+        while len(insights) > self.INSIGHT_CACHE_SIZE:
+            insights.popitem(last=False)
+    
+    def _extract_location(self, lines):
+        """Extract current location from the lines of a game output"""
+        # This runs on every line of every turn; only format the trace when it's shown
+        verbose = self.verbose
+        if verbose:
+            self._debug(f"🔍 Extracting location from {len(lines)} lines")
         
         # Look for the pattern: COMMAND\n Location Name Score: X Moves: Y
         for i, line in enumerate(lines):
             line = line.strip()
-            self._debug(f"🔍 Line {i}: '{line}'")
+            if verbose:
+                self._debug(f"🔍 Line {i}: '{line}'")
             
             # Check if this line contains a command (uppercase words)
             if line.isupper() and len(line.split()) <= 3:
-                self._debug(f"🔍 Found command: '{line}'")
+                if verbose:
+                    self._debug(f"🔍 Found command: '{line}'")
                 # Next line should be the location with score
                 if i + 1 < len(lines):
                     next_line = lines[i + 1].strip()
-                    self._debug(f"🔍 Next line: '{next_line}'")
+                    if verbose:
+                        self._debug(f"🔍 Next line: '{next_line}'")
                     # Extract location name (everything before "Score:")
                     if "Score:" in next_line:
                         location = next_line.split("Score:")[0].strip()
-                        self._debug(f"🔍 Extracted location: '{location}'")
+                        if verbose:
+                            self._debug(f"🔍 Extracted location: '{location}'")
                         return location
                     # Fallback: if no score line, use the whole line
                     elif next_line and "Moves:" not in next_line:
-                        self._debug(f"🔍 Using fallback location: '{next_line}'")
+                        if verbose:
+                            self._debug(f"🔍 Using fallback location: '{next_line}'")
                         return next_line
             # Also check for "You are in/at" patterns as fallback
             elif "You are in" in line or "You are at" in line:
-                self._debug(f"🔍 Found 'You are' pattern: '{line}'")
+                if verbose:
+                    self._debug(f"🔍 Found 'You are' pattern: '{line}'")
                 return line.strip()
         
         self._debug("🔍 No location found")
@@ -430,76 +953,63 @@ Play strategically and try to make meaningful progress. Output ONLY the next com
     def _summarize_location(self, game_output):
         """Create a brief summary of location insights"""
         # Extract key details about the location
-        key_details = []
-        lines = game_output.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            if any(keyword in line.lower() for keyword in ['door', 'passage', 'stair', 'ladder', 'trap', 'treasure', 'monster']):
-                key_details.append(line)
-        
+        key_details = [line.strip() for line in self.LOCATION_DETAIL_RE.findall(game_output)]
         return key_details[:3]  # Keep only top 3 insights
     
     def _extract_items(self, game_output):
         """Extract items mentioned in the game output"""
+        # Item names are the word after take/find/see (simple heuristic)
         items = []
-        lines = game_output.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            if any(keyword in line.lower() for keyword in ['you take', 'you find', 'you see']):
-                # Extract item names (simple heuristic)
-                words = line.split()
-                for i, word in enumerate(words):
-                    if word.lower() in ['take', 'find', 'see'] and i + 1 < len(words):
-                        items.append(words[i + 1])
-        
+        for line in self.ITEM_LINE_RE.findall(game_output):
+            items.extend(self.ITEM_WORD_RE.findall(line))
         return items
     
-    def _summarize_item(self, game_output, item):
+    def _summarize_item(self, lines, lower_lines, item):
         """Create a brief summary of item insights"""
         # Look for descriptions of the item
-        lines = game_output.split('\n')
-        for line in lines:
-            if item.lower() in line.lower() and len(line) > 10:
+        lower_item = item.lower()
+        for line, lower_line in zip(lines, lower_lines):
+            if lower_item in lower_line and len(line) > 10:
                 return line.strip()
         return f"Found {item}"
     
     def _identify_puzzle(self, game_output):
         """Identify if there's a puzzle to solve"""
-        if "You can't" in game_output and any(keyword in game_output.lower() for keyword in ['door', 'gate', 'passage', 'open']):
+        if "You can't" in game_output and self.PUZZLE_RE.search(game_output):
             return "door_puzzle"
         return None
     
-    def _extract_solution_hint(self, game_output):
+    def _extract_solution_hint(self, lines):
         """Extract hints about puzzle solutions"""
-        lines = game_output.split('\n')
         for line in lines:
-            if any(keyword in line.lower() for keyword in ['key', 'lever', 'button', 'switch', 'password']):
+            if self.SOLUTION_RE.search(line):
                 return line.strip()
         return "Need to find solution"
     
-    def _extract_fact(self, game_output, command, response):
-        """Extract a general fact from the interaction"""
+    def _extract_fact(self, command, response, phrases):
+        """Extract a general fact from the interaction, given the important phrases it contains"""
         # Create a concise fact about what happened
-        if "You can't" in response:
+        if "You can't" in phrases:
             return f"Cannot {command.lower()} - {response[:50]}"
-        elif "You take" in response:
+        elif "You take" in phrases:
             return f"Successfully took item with {command}"
-        elif "You open" in response:
+        elif "You open" in phrases:
             return f"Successfully opened with {command}"
         return None
     
-    def _update_location_map(self, game_output, location):
+    def _update_location_map(self, lower_output, location):
         """Update the location map with connections and short name"""
-        # Extract short name for location
-        short_name = self._extract_short_name(location)
-        self.location_names[location] = short_name
+        # Extract short name for location; it only depends on the name, so
+        # location_names already holds it for any place seen before
+        if location not in self.location_names:
+            self.location_names[location] = self._extract_short_name(location)
+            self._learning_context = None
         
         # Extract connections (exits, passages, doors)
-        connections = self._extract_connections(game_output)
-        if connections:
+        connections = self._extract_connections(lower_output)
+        if connections and self.location_map.get(location) != connections:
             self.location_map[location] = connections
+            self._learning_context = None
     
     def _extract_short_name(self, location):
         """Extract a short name for the location"""
@@ -513,36 +1023,11 @@ Play strategically and try to make meaningful progress. Output ONLY the next com
             return " ".join(words[:3])
         return location[:25] + "..." if len(location) > 25 else location
     
-    def _extract_connections(self, game_output):
-        """Extract available connections/exits from location description"""
-        connections = []
-        lines = game_output.split('\n')
-        
-        for line in lines:
-            line = line.strip().lower()
-            # Look for direction indicators
-            if any(direction in line for direction in ['north', 'south', 'east', 'west', 'up', 'down', 'northeast', 'northwest', 'southeast', 'southwest']):
-                # Extract the direction
-                for direction in ['north', 'south', 'east', 'west', 'up', 'down', 'northeast', 'northwest', 'southeast', 'southwest']:
-                    if direction in line:
-                        connections.append(direction)
-            # Look for door/passage indicators
-            elif any(keyword in line for keyword in ['door', 'passage', 'staircase', 'ladder', 'tunnel']):
-                # Try to extract direction from context
-                if 'north' in line or 'n' in line:
-                    connections.append('north')
-                elif 'south' in line or 's' in line:
-                    connections.append('south')
-                elif 'east' in line or 'e' in line:
-                    connections.append('east')
-                elif 'west' in line or 'w' in line:
-                    connections.append('west')
-                elif 'up' in line or 'u' in line:
-                    connections.append('up')
-                elif 'down' in line or 'd' in line:
-                    connections.append('down')
-        
-        return list(set(connections))  # Remove duplicates
+    def _extract_connections(self, lower_output):
+        """Extract available connections/exits from a lowercased location description"""
+        # Whole direction words only, so "cupboard" isn't "up"; sorted so the
+        # same room always gives the same list
+        return sorted(set(self.DIRECTION_RE.findall(lower_output)))
     
     def get_map_context(self):
         """Get lightweight map context for AI"""
@@ -557,10 +1042,9 @@ Play strategically and try to make meaningful progress. Output ONLY the next com
             context.append(f"Current: {short_name}")
         
         # Add recent locations (last 5)
-        recent_locations = list(self.visited_locations)[-5:]
-        if recent_locations:
+        if self.recent_locations:
             context.append("Recent locations:")
-            for loc in recent_locations:
+            for loc in self.recent_locations:
                 short_name = self.location_names.get(loc, "Unknown")
                 connections = self.location_map.get(loc, [])
                 if connections:
@@ -572,36 +1056,53 @@ Play strategically and try to make meaningful progress. Output ONLY the next com
     
     def save_learning(self):
         """Save learning data to file"""
-        import json
-        
         learning_data = {
             'learned_facts': self.learned_facts[-20:],  # Keep only last 20 facts
             'location_insights': self.location_insights,
             'item_insights': self.item_insights,
             'puzzle_solutions': self.puzzle_solutions,
-            'turn_count': self.turn_count,
             # Map data
             'location_map': self.location_map,
             'location_names': self.location_names,
-            'visited_locations': list(self.visited_locations),
-            'current_location': self.current_location
+            'visited_locations': sorted(self.visited_locations),  # sorted so unchanged data hashes the same
+            'recent_locations': list(self.recent_locations),
+            'current_location': self.current_location,
+            # Commands the AI chose for game states, oldest first. Repeat
+            # counts and fallbacks only mean something within one run.
+            'command_cache': {
+                key: command for key, (command, _, chosen) in self._state_cache.items() if chosen
+            }
         }
         
-        self._debug(f"💾 Saving learning: {len(self.learned_facts)} facts, {len(self.visited_locations)} locations")
-        self._debug(f"💾 Current location: {self.current_location}")
-        self._debug(f"💾 Visited locations: {list(self.visited_locations)}")
+        if self.verbose:
+            self._debug(f"💾 Saving learning: {len(self.learned_facts)} facts, {len(self.visited_locations)} locations")
+            self._debug(f"💾 Current location: {self.current_location}")
+            self._debug(f"💾 Visited locations: {list(self.visited_locations)}")
         
         try:
-            with open(self.learning_file, 'w') as f:
-                json.dump(learning_data, f, indent=2)
+            # Compact separators: the file is rewritten on every autosave
+            body = json.dumps(learning_data, separators=(',', ':'))
+            # turn_count moves on with every autosave, so it is left out of
+            # the digest and added in front of the other keys afterwards
+            digest = hashlib.blake2b(body.encode(), digest_size=16).digest()
+            if digest == self._last_learning_hash:
+                self._debug("Learning unchanged, not rewriting file")
+                return
+            blob = f'{{"turn_count":{self.turn_count},{body[1:]}'
+            
+            # Write a temporary file and swap it in, so a crash mid-write
+            # can't leave a truncated learning file behind
+            tmp_file = self.learning_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                f.write(blob)
+            os.replace(tmp_file, self.learning_file)
+            self._last_learning_hash = digest
             self._debug(f"Learning saved to: {self.learning_file}")
         except Exception as e:
             self._debug(f"Error saving learning: {e}")
     
     def load_learning(self):
         """Load learning data from file"""
-        import json
-        
         if not os.path.exists(self.learning_file):
             return False
         
@@ -610,15 +1111,24 @@ Play strategically and try to make meaningful progress. Output ONLY the next com
                 learning_data = json.load(f)
             
             self.learned_facts = learning_data.get('learned_facts', [])
-            self.location_insights = learning_data.get('location_insights', {})
-            self.item_insights = learning_data.get('item_insights', {})
+            # Saved oldest first; keep only the newest entries up to the cap
+            self.location_insights = OrderedDict(list(learning_data.get('location_insights', {}).items())[-self.INSIGHT_CACHE_SIZE:])
+            self.item_insights = OrderedDict(list(learning_data.get('item_insights', {}).items())[-self.INSIGHT_CACHE_SIZE:])
             self.puzzle_solutions = learning_data.get('puzzle_solutions', {})
             
             # Load map data
             self.location_map = learning_data.get('location_map', {})
             self.location_names = learning_data.get('location_names', {})
             self.visited_locations = set(learning_data.get('visited_locations', []))
+            self.recent_locations = deque(learning_data.get('recent_locations', []), maxlen=5)
+            self._learning_context = None
             self.current_location = learning_data.get('current_location', None)
+            # Older files saved [command, repeats] pairs; either way a
+            # loaded command starts this run as not yet repeated
+            self._state_cache = OrderedDict(
+                (key, (entry if isinstance(entry, str) else entry[0], 0, True))
+                for key, entry in learning_data.get('command_cache', {}).items()
+            )
             
             self._debug(f"Learning loaded from: {self.learning_file}")
             return True
@@ -628,6 +1138,10 @@ Play strategically and try to make meaningful progress. Output ONLY the next com
     
     def get_learning_context(self):
         """Get relevant learning context for AI without full conversation history"""
+        # Most turns learn nothing new, so the text is only rebuilt after
+        # something it shows has changed
+        if self._learning_context is not None:
+            return self._learning_context
         context = []
         
         # Add map context first (most important for navigation)
@@ -641,16 +1155,16 @@ Play strategically and try to make meaningful progress. Output ONLY the next com
             for fact in self.learned_facts[-5:]:
                 context.append(f"- {fact}")
         
-        # Add location insights if we have them
+        # Add location insights if we have them, most recent first
         if self.location_insights:
             context.append("\nKnown locations:")
-            for location, insights in list(self.location_insights.items())[-3:]:
+            for location, insights in list(reversed(self.location_insights.items()))[:3]:
                 context.append(f"- {location}: {', '.join(insights[:2])}")
         
-        # Add item insights
+        # Add item insights, most recent first
         if self.item_insights:
             context.append("\nKnown items:")
-            for item, insight in list(self.item_insights.items())[-3:]:
+            for item, insight in list(reversed(self.item_insights.items()))[:3]:
                 context.append(f"- {item}: {insight}")
         
         # Add puzzle solutions
@@ -659,143 +1173,168 @@ Play strategically and try to make meaningful progress. Output ONLY the next com
             for puzzle, solution in self.puzzle_solutions.items():
                 context.append(f"- {puzzle}: {solution}")
         
-        return "\n".join(context) if context else ""
+        self._learning_context = "\n".join(context)
+        return self._learning_context
     
-    def save_game(self):
-        """Save the current game state"""
-        self._debug(f"Attempting to save game to: {self.save_file}")
+    def _file_command(self, command, filename):
+        """Run SAVE or RESTORE, answer the filename prompt and return the game's reply"""
+        self.game_process.sendline(command)
         
+        # Read each step of the exchange with the same pty reader as a
+        # normal turn, stopping at the prompt that step ends on
         try:
-            # Send SAVE command
-            self.game_process.sendline('SAVE')
+            prompt = self._read_until_prompt(timeout=5, tail_re=self.FILENAME_TAIL_RE)
+            self._debug(f"{command.title()} prompt: {prompt}")
+        except pexpect.TIMEOUT:
+            # Send the filename anyway in case the prompt looked different
+            self._debug(f"No {command.lower()} prompt seen, sending the filename anyway")
+        self.game_process.sendline(filename)
+        
+        result = self._read_until_prompt(timeout=10, tail_re=self.FILE_REPLY_TAIL_RE)
+        if 'Overwrite existing file' in result:
+            self._debug(f"Found overwrite prompt during {command.lower()}, responding with 'yes'")
+            self.game_process.sendline('yes')
+            result = self._read_until_prompt(timeout=10)
+        
+        # Get the final result
+        return result
+    
+    def save_game(self, history=None):
+        """Save the current game state and return whether the save file was written"""
+        self._debug(f"Attempting to save game to: {self.save_file}")
+        
+        with self._game_lock:
+            try:
+                result = self._file_command('SAVE', self.save_file)
+                if self.verbose:
+                    self._debug(f"Save result: {result}")
+            
+                # Check if save file exists
+                actual_file = self._find_save_file()
+                if actual_file:
+                    print(f"\n{self.GREEN}💾 Game saved to: {actual_file}{self.RESET}")
+                    save_success = True
+                    self._unsaved_changes = False
+                    self._save_history(history)
+                else:
+                    print(f"\n{self.YELLOW}⚠️  Warning: Save file not created{self.RESET}")
+                    save_success = False
             
-            # Wait for filename prompt - look for bracket or colon
-            idx = self.game_process.expect(['\\[', ':', pexpect.TIMEOUT], timeout=5)
-            prompt = self.game_process.before
-            self._debug(f"Save prompt (matched pattern {idx}): {prompt}")
+                # The turn loop still has the output from before the save, so
+                # there's no need to LOOK again
+                return save_success
             
-            # Read until the prompt character if we haven't consumed it
-            if idx in [0, 1]:  # Found [ or :
-                # Read to end of line to get full prompt
+            except pexpect.TIMEOUT as e:
+                print(f"\n{self.YELLOW}⚠️  Timeout during save{self.RESET}")
+                self._debug(f"Timeout detail: {e}")
+                # Try to recover by reading what we have
                 try:
-                    self.game_process.expect('\n', timeout=1)
+                    remaining = self.game_process.read_nonblocking(size=1000, timeout=0.5)
+                    self._debug(f"Remaining output: {remaining}")
                 except:
                     pass
-            
-            # Send filename
-            self.game_process.sendline(self.save_file)
-            
-            # Check for "Overwrite existing file?" prompt
-            try:
-                # Wait a moment for potential overwrite prompt
-                overwrite_idx = self.game_process.expect(['Overwrite existing file', '>', pexpect.TIMEOUT], timeout=3)
-                if overwrite_idx == 0:  # Found overwrite prompt
-                    self._debug("Found overwrite prompt, responding with 'yes'")
-                    self.game_process.sendline('yes')
-                    # Wait for the result after overwrite confirmation
-                    self.game_process.expect('>', timeout=10)
-                elif overwrite_idx == 1:  # Found prompt directly (no overwrite needed)
-                    pass  # Already at prompt
-                else:  # Timeout - assume no overwrite needed
-                    pass
-            except pexpect.TIMEOUT:
-                # No overwrite prompt, continue
-                pass
-            
-            # Get the final result
-            result = self.game_process.before
-            self._debug(f"Save result: {result}")
-            
-            # Check if save file exists
-            save_exists = os.path.exists(self.save_file)
-            save_with_qzl = os.path.exists(self.save_file + '.qzl')
-            
-            if save_exists or save_with_qzl:
-                actual_file = self.save_file if save_exists else self.save_file + '.qzl'
-                print(f"\n{self.GREEN}💾 Game saved to: {actual_file}{self.RESET}")
-                save_success = True
-            else:
-                print(f"\n{self.YELLOW}⚠️  Warning: Save file not created{self.RESET}")
-                save_success = False
-            
-            # Send LOOK to refresh game state
-            self.game_process.sendline('LOOK')
-            self.game_process.expect('>', timeout=5)
-            current_state = self.game_process.before.strip()
-            
-            return save_success, current_state
-            
-        except pexpect.TIMEOUT as e:
-            print(f"\n{self.YELLOW}⚠️  Timeout during save{self.RESET}")
-            self._debug(f"Timeout detail: {e}")
-            # Try to recover by reading what we have
-            try:
-                remaining = self.game_process.read_nonblocking(size=1000, timeout=0.5)
-                self._debug(f"Remaining output: {remaining}")
-            except:
-                pass
-            return False, ""
+                return False
+            except Exception as e:
+                self._debug(f"Save error: {e}")
+                return False
+    
+    def _history_snapshot(self):
+        """Copy the digest and conversation window as they stand between turns"""
+        return {'digest': self.digest, 'messages': list(self.conversation_history)}
+    
+    def _save_history(self, history=None):
+        """Write a conversation snapshot (by default the current one) next to the save file"""
+        if history is None:
+            history = self._history_snapshot()
+        try:
+            # Swap in a complete file, like save_learning, so a crash
+            # mid-write can't leave a truncated history behind
+            tmp_file = self.history_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(history, f, separators=(',', ':'))
+            os.replace(tmp_file, self.history_file)
         except Exception as e:
-            self._debug(f"Save error: {e}")
-            return False, ""
+            self._debug(f"Error saving history: {e}")
+    
+    def _load_history(self):
+        """Pick up the conversation saved with the game being restored"""
+        if not os.path.exists(self.history_file):
+            return
+        try:
+            with open(self.history_file, 'r') as f:
+                history = json.load(f)
+        except Exception as e:
+            self._debug(f"Error loading history: {e}")
+            return
+        self.digest = history.get('digest', "")
+        # Keep whole turns only, so the window starts on a game output and
+        # ends on the command answering it: drop a game output still
+        # waiting for its command, then trim to a freshly reset window
+        messages = history.get('messages', [])
+        if messages and messages[-1].get('role') == 'user':
+            messages = messages[:-1]
+        messages = messages[-2 * self.window:]
+        if messages and messages[0].get('role') != 'user':
+            messages = messages[1:]
+        self.conversation_history = messages
+        self._debug(f"Loaded {len(self.conversation_history)} messages of conversation history")
+    
+    def _autosave(self, history=None):
+        """Save the game and learning data (runs on the background pool)"""
+        # After nothing but queries the save file already holds this state,
+        # so skip the SAVE round trips
+        if self._unsaved_changes:
+            self.save_game(history)
+        else:
+            self._debug("Skip autosave: state unchanged")
+        self.save_learning()
+    
+    def _finish_autosave(self):
+        """Wait for a background autosave before the game is used again"""
+        if self._save_future:
+            self._save_future.result()
+            self._save_future = None
+    
+    def _find_save_file(self):
+        """Return the save file Frotz actually wrote, or None if there isn't one"""
+        # Frotz keeps using the same name, so once it's known one stat confirms it
+        if self._resolved_save_path and os.path.exists(self._resolved_save_path):
+            return self._resolved_save_path
+        
+        # Otherwise list the save directory once instead of testing each name
+        try:
+            with os.scandir(os.path.dirname(self.save_file) or '.') as entries:
+                names = {entry.name for entry in entries}
+        except OSError:
+            names = set()
+        for candidate in self._save_candidates:
+            if os.path.basename(candidate) in names:
+                self._resolved_save_path = candidate
+                return candidate
+        self._resolved_save_path = None
+        return None
     
     def restore_game(self):
         """Restore a saved game state"""
         # Check for save file
-        save_exists = os.path.exists(self.save_file)
-        save_with_qzl = os.path.exists(self.save_file + '.qzl')
-        
-        if not save_exists and not save_with_qzl:
+        actual_file = self._find_save_file()
+        if not actual_file:
             print(f"\n{self.YELLOW}⚠️  No save file found{self.RESET}")
             return False
         
-        actual_file = self.save_file if save_exists else self.save_file + '.qzl'
         self._debug(f"Restoring from: {actual_file}")
         print(f"\n{self.CYAN}📂 Restoring from save file...{self.RESET}")
         
         try:
-            # Send RESTORE command
-            self.game_process.sendline('RESTORE')
-            
-            # Wait for filename prompt - look for bracket or colon
-            idx = self.game_process.expect(['\\[', ':', pexpect.TIMEOUT], timeout=5)
-            self._debug(f"Restore prompt (matched pattern {idx})")
-            
-            # Read until end of prompt line
-            if idx in [0, 1]:
-                try:
-                    self.game_process.expect('\n', timeout=1)
-                except:
-                    pass
-            
-            # Send filename
-            self.game_process.sendline(actual_file)
-            
-            # Check for "Overwrite existing file?" prompt
-            try:
-                # Wait a moment for potential overwrite prompt
-                overwrite_idx = self.game_process.expect(['Overwrite existing file', '>', pexpect.TIMEOUT], timeout=3)
-                if overwrite_idx == 0:  # Found overwrite prompt
-                    self._debug("Found overwrite prompt during restore, responding with 'yes'")
-                    self.game_process.sendline('yes')
-                    # Wait for the result after overwrite confirmation
-                    self.game_process.expect('>', timeout=10)
-                elif overwrite_idx == 1:  # Found prompt directly (no overwrite needed)
-                    pass  # Already at prompt
-                else:  # Timeout - assume no overwrite needed
-                    pass
-            except pexpect.TIMEOUT:
-                # No overwrite prompt, continue
-                pass
-            
-            # Get the final result
-            result = self.game_process.before
+            result = self._file_command('RESTORE', actual_file)
             self._debug(f"Restore result: {result}")
+            self._obs_cache.clear()  # replies from before the restore no longer apply
+            self._unsaved_changes = False
+            self._load_history()
             
             # Send LOOK to get current state
             self.game_process.sendline('LOOK')
-            self.game_process.expect('>', timeout=5)
-            game_state = self.game_process.before.strip()
+            game_state = self._read_until_prompt(timeout=5).strip()
             
             print(f"{self.GREEN}✓ Game restored{self.RESET}")
             return game_state
@@ -808,6 +1347,33 @@ Play strategically and try to make meaningful progress. Output ONLY the next com
             self._debug(f"Restore error: {e}")
             return False
     
+    def _restart_game(self):
+        """Restart the game in the running interpreter and return its opening text"""
+        # The confirmation question isn't followed by the usual prompt line,
+        # so it is answered here rather than left to send_command to wait out
+        with self._game_lock:
+            try:
+                self.game_process.sendline('RESTART')
+                if self.game_process.expect_list(self._restart_prompt_pats, timeout=5) == 0:
+                    self._debug("Confirming restart")
+                    self.game_process.sendline('yes')
+                output = self._read_until_prompt(timeout=10).strip()
+            except pexpect.TIMEOUT:
+                self._debug("Timeout waiting for restart")
+                return "Error: Game did not respond in time"
+        
+        # Everything known about the old game's state is stale now
+        self._obs_cache.clear()
+        self._room_sig = ""
+        self._unsaved_changes = True
+        self.command_queue.clear()
+        return output
+    
+    def _show_response(self, game_output):
+        """Print the game's reply under its header in a single write"""
+        sys.stdout.write(f"\n{self.PFX_RESPONSE}\n{self.YELLOW}{game_output}{self.RESET}\n")
+        sys.stdout.flush()
+    
     def play(self):
         """Main game loop"""
         print("Starting Zork AI Player...")
@@ -833,73 +1399,87 @@ Play strategically and try to make meaningful progress. Output ONLY the next com
         
         # Check if we should restore from save
         restore_from_save = False
-        save_exists = os.path.exists(self.save_file) or os.path.exists(self.save_file + '.qzl')
-        if save_exists:
-            actual_file = self.save_file if os.path.exists(self.save_file) else self.save_file + '.qzl'
+        actual_file = self._find_save_file()
+        if actual_file:
             print(f"\n{self.CYAN}Found existing save file: {actual_file}{self.RESET}")
-            response = input(f"{self.CYAN}Resume from save? (y/n): {self.RESET}").strip().lower()
-            restore_from_save = response in ['y', 'yes']
+            if self.resume is None:
+                response = input(f"{self.CYAN}Resume from save? (y/n): {self.RESET}").strip().lower()
+                restore_from_save = response in ['y', 'yes']
+            else:
+                restore_from_save = self.resume
         
         if restore_from_save:
             game_output = self.restore_game()
-            print("=" * 70)
-            print(f"{self.MAGENTA}{self.BOLD}RESTORED GAME STATE:{self.RESET}")
-            print("=" * 70)
-            print(f"{self.YELLOW}{game_output}{self.RESET}")
-            print("=" * 70)
-        else:
-            print("=" * 70)
-            print(f"{self.MAGENTA}{self.BOLD}INITIAL GAME OUTPUT:{self.RESET}")
-            print("=" * 70)
-            print(f"{self.YELLOW}{initial_output}{self.RESET}")
-            print("=" * 70)
+            title = "RESTORED GAME STATE:"
+            if not isinstance(game_output, str):
+                # restore_game returns False on a timeout or error; play on
+                # from the opening text instead
+                print(f"\n{self.YELLOW}⚠️  Restore failed, starting from the beginning{self.RESET}")
+                restore_from_save = False
+        if not restore_from_save:
             game_output = initial_output
+            title = "INITIAL GAME OUTPUT:"
+        # Banners go out in one write rather than a print (and flush) per line
+        sys.stdout.write(
+            f"{self.SEP}\n{self.MAGENTA}{self.BOLD}{title}{self.RESET}\n{self.SEP}\n"
+            f"{self.YELLOW}{game_output}{self.RESET}\n{self.SEP}\n"
+        )
+        sys.stdout.flush()
         
         # Game loop
+        pending_command = None  # AI request already in flight (pipeline mode)
         for turn in range(1, self.max_turns + 1):
             self.turn_count = turn
-            print(f"\n{'=' * 70}")
-            print(f"{self.GREEN}{self.BOLD}▶ TURN {turn}{self.RESET}")
-            print(f"{'=' * 70}")
+            sys.stdout.write(f"\n{self.SEP}\n{self.HDR_TURN}{turn}{self.RESET}\n{self.SEP}\n")
+            sys.stdout.flush()
             
             # Get command from AI
-            command = self.get_ai_command(game_output)
-            print(f"\n{self.CYAN}{self.BOLD}🤖 AI Command:{self.RESET} {self.CYAN}{command}{self.RESET}")
+            if pending_command:
+                command = pending_command.result()
+                pending_command = None
+            else:
+                command = self.get_ai_command(game_output)
+            print(f"\n{self.PFX_AI}{command}{self.RESET}")
             
-            # Check for quit - allow it if we're at max_turns or if AI is dead (ghost world)
+            # Check for quit - allow it if we're at max_turns; a dead AI (ghost
+            # world) restarts instead
             if command.upper() in ['QUIT', 'Q']:
-                # Check if AI is in ghost world (dead) by looking for "passes through" in recent output
-                is_dead = "passes through" in game_output.lower() or "ghost" in game_output.lower()
+                # Check if AI is dead (ghost world or death banner) in recent output
+                is_dead = bool(self.DEATH_RE.search(game_output))
                 
-                if turn >= self.max_turns or is_dead:
-                    if is_dead:
-                        print("\nAI is dead (ghost world) - allowing quit to restart.")
-                    else:
-                        print("\nAI decided to quit the game (reached max turns).")
+                if turn >= self.max_turns:
+                    print("\nAI decided to quit the game (reached max turns).")
                     if self.auto_save:
-                        self.save_game()  # Don't need return value here
+                        self._finish_autosave()
+                        self._autosave()
                     break
+                elif is_dead:
+                    print(f"\n{self.YELLOW}💀 AI is dead (ghost world) - restarting the game...{self.RESET}")
+                    # RESTART in the running interpreter (confirmed below) instead
+                    # of ending the session and starting Frotz all over again
+                    command = "RESTART"
                 else:
                     print(f"\n{self.YELLOW}⚠️  AI tried to quit early (turn {turn}/{self.max_turns}), continuing...{self.RESET}")
                     # Convert QUIT to a different command to keep the game going
                     command = "LOOK"  # Safe command that won't break the game
             
             # Send command to game
-            game_output = self.send_command(command)
-            print(f"\n{self.YELLOW}{self.BOLD}📜 Game Response:{self.RESET}")
-            print(f"{self.YELLOW}{game_output}{self.RESET}")
-            
-            # Handle RESTART confirmation
-            if command.upper() == 'RESTART' and "Are you sure you want to restart?" in game_output:
-                print(f"\n{self.CYAN}🤖 AI Command:{self.RESET} {self.CYAN}yes{self.RESET}")
-                confirmation_output = self.send_command("yes")
-                print(f"\n{self.YELLOW}{self.BOLD}📜 Game Response:{self.RESET}")
-                print(f"{self.YELLOW}{confirmation_output}{self.RESET}")
-                game_output = confirmation_output
+            self._finish_autosave()
+            if command.upper() == 'RESTART':
+                game_output = self._restart_game()
+            else:
+                game_output = self.send_command(command)
+            self._show_response(game_output)
             
             # Extract learning from this interaction
             self.extract_learning(game_output, command, game_output)
             
+            # A planned command that failed means the plan no longer fits
+            # the game, so ask again next turn
+            if self.command_queue and self.PLAN_FAILURE_RE.search(game_output):
+                self._debug(f"Dropping {len(self.command_queue)} planned commands")
+                self.command_queue.clear()
+            
             # Check if we got empty output (possible timeout issue)
             if not game_output.strip():
                 print(f"\n{self.YELLOW}⚠️  Warning: Got empty response{self.RESET}")
@@ -908,114 +1488,163 @@ Play strategically and try to make meaningful progress. Output ONLY the next com
             # Don't automatically end - let max_turns or AI's QUIT command handle it
             # (Previously was checking for "quit" which gave false positives on words like "antiquity")
             
-            # Auto-save every 10 turns
-            if self.auto_save and turn % 10 == 0:
-                save_success, new_state = self.save_game()
-                # Save learning data
-                self.save_learning()
-                # Update game_output with fresh state after save
-                if new_state:
-                    game_output = new_state
-                    self._debug("Game state refreshed after autosave")
+            # Copy the conversation for the autosave below while it ends on
+            # this turn's command; the next AI request adds to it right away
+            autosave_due = self.auto_save and turn % 10 == 0
+            history = self._history_snapshot() if autosave_due else None
+            
+            # Ask for the next command now so the request overlaps the
+            # autosave below
+            if self.pipeline and turn < self.max_turns:
+                pending_command = self._pool.submit(self.get_ai_command, game_output)
             
-            # Small delay between turns
-            time.sleep(0.5)
+            # Auto-save every 10 turns. The save runs in the background while
+            # the next command is requested and is finished before that
+            # command reaches the game.
+            if autosave_due:
+                self._save_future = self._pool.submit(self._autosave, history)
+            
+            # Turns run back to back unless a pause was asked for
+            if self.throttle:
+                time.sleep(self.throttle)
         
         # Final save before exit
+        self._finish_autosave()
         if self.auto_save and self.turn_count > 0:
             print(f"\n{self.CYAN}Saving final game state...{self.RESET}")
-            self.save_game()  # Don't need return value here
-            self.save_learning()  # Save final learning data
+            self._autosave()  # game and final learning data
         
         # Clean up
+        self._pool.shutdown()
         if self.game_process and self.game_process.isalive():
             self.game_process.terminate()
             self.game_process.wait()
         
-        print(f"\n{'=' * 70}")
-        print(f"{self.GREEN}{self.BOLD}✓ GAME SESSION COMPLETE{self.RESET}")
-        print(f"Turns played: {self.turn_count}")
+        summary = (
+            f"\n{self.SEP}\n{self.GREEN}{self.BOLD}✓ GAME SESSION COMPLETE{self.RESET}\n"
+            f"Turns played: {self.turn_count}\n"
+        )
         if self.auto_save:
-            save_exists = os.path.exists(self.save_file) or os.path.exists(self.save_file + '.qzl')
-            if save_exists:
-                actual_file = self.save_file if os.path.exists(self.save_file) else self.save_file + '.qzl'
-                print(f"Save file: {actual_file}")
-        print(f"{'=' * 70}")
+            actual_file = self._find_save_file()
+            if actual_file:
+                summary += f"Save file: {actual_file}\n"
+        sys.stdout.write(f"{summary}{self.SEP}\n")
+        sys.stdout.flush()
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python zork_ai_player.py <path_to_zork.z5> [max_turns] [options]")
-        print("\nOptions:")
-        print("  --verbose, -v         Show debug messages in grey")
-        print("  --no-autosave        Disable automatic saving")
-        print("  --save-file <path>   Use custom save file path")
-        print("  --ollama              Use Ollama instead of Anthropic API")
-        print("  --ollama-model <name> Ollama model to use (default: llama3.2)")
-        print("  --ollama-url <url>    Ollama server URL (default: http://localhost:11434)")
-        print("\nExamples:")
-        print("  python zork_ai_player.py games/zork1.z5 30")
-        print("  python zork_ai_player.py games/zork1.z5 30 --verbose")
-        print("  python zork_ai_player.py games/zork1.z5 50 --no-autosave")
-        print("  python zork_ai_player.py games/zork1.z5 --save-file my_save.sav")
-        print("  python zork_ai_player.py games/zork1.z5 --ollama")
-        print("  python zork_ai_player.py games/zork1.z5 --ollama --ollama-model llama3.2")
-        print("  python zork_ai_player.py games/zork1.z5 --ollama --ollama-url http://localhost:11434")
-        sys.exit(1)
+def play_many(game_file, sessions, save_file=None, **kwargs):
+    """Play several independent sessions of the same game at once"""
+    # Each session blocks on its own dfrotz process and API calls, so plain
+    # threads give the overlap. Sessions share one Anthropic client, and each
+    # gets its own save and learning file so they don't overwrite each other.
+    # The save files are numbered from save_file when one is given.
+    game_name = os.path.splitext(os.path.basename(game_file))[0]
+    if save_file:
+        save_base, save_ext = os.path.splitext(save_file)
+        save_dir = os.path.dirname(save_file) or '.'
+    else:
+        save_dir = os.path.join(os.path.dirname(game_file), 'saves')
+        save_base, save_ext = os.path.join(save_dir, f'{game_name}_autosave'), '.qzl'
+    os.makedirs(save_dir, exist_ok=True)
     
-    game_file = sys.argv[1]
-    max_turns = 50
-    verbose = False
-    auto_save = True
-    save_file = None
-    use_ollama = False
-    ollama_model = "llama3.2"
-    ollama_url = "http://localhost:11434"
-    
-    # Parse arguments
-    i = 2
-    while i < len(sys.argv):
-        arg = sys.argv[i]
-        if arg == '--verbose' or arg == '-v':
-            verbose = True
-        elif arg == '--no-autosave':
-            auto_save = False
-        elif arg == '--save-file' and i + 1 < len(sys.argv):
-            save_file = sys.argv[i + 1]
-            i += 1
-        elif arg == '--ollama':
-            use_ollama = True
-        elif arg == '--ollama-model' and i + 1 < len(sys.argv):
-            ollama_model = sys.argv[i + 1]
-            i += 1
-        elif arg == '--ollama-url' and i + 1 < len(sys.argv):
-            ollama_url = sys.argv[i + 1]
-            i += 1
-        elif arg.isdigit():
-            max_turns = int(arg)
-        i += 1
+    players = []
+    for i in range(1, sessions + 1):
+        player = ZorkPlayer(
+            game_file,
+            save_file=f'{save_base}_{i}{save_ext}',
+            resume=False,
+            client=getattr(players[0], 'client', None) if players else None,
+            **kwargs
+        )
+        player.learning_file = os.path.join(save_dir, f'{game_name}_learning_{i}.json')
+        players.append(player)
+    
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        for future in [pool.submit(player.play) for player in players]:
+            future.result()
+
+def positive_int(value):
+    """argparse type for counts that must be at least 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Let an AI play a Frotz text adventure.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""Examples:
+  python zork_ai_player.py games/zork1.z5 30
+  python zork_ai_player.py games/zork1.z5 30 --verbose
+  python zork_ai_player.py games/zork1.z5 50 --no-autosave
+  python zork_ai_player.py games/zork1.z5 --save-file my_save.sav
+  python zork_ai_player.py games/zork1.z5 --ollama
+  python zork_ai_player.py games/zork1.z5 --ollama --ollama-model llama3.2
+  python zork_ai_player.py games/zork1.z5 --ollama --ollama-url http://localhost:11434"""
+    )
+    parser.add_argument('game_file', help="Path to the game file, e.g. games/zork1.z5")
+    parser.add_argument('max_turns', nargs='?', type=int, default=50, help="Number of turns to play (default: 50)")
+    parser.add_argument('--verbose', '-v', action='store_true', help="Show debug messages in grey")
+    parser.add_argument('--no-autosave', dest='auto_save', action='store_false', help="Disable automatic saving")
+    parser.add_argument('--save-file', metavar='PATH', help="Use custom save file path")
+    parser.add_argument('--ollama', dest='use_ollama', action='store_true', help="Use Ollama instead of Anthropic API")
+    parser.add_argument('--ollama-model', metavar='NAME', default="llama3.2", help="Ollama model to use (default: llama3.2)")
+    parser.add_argument('--ollama-url', metavar='URL', default="http://localhost:11434", help="Ollama server URL (default: http://localhost:11434)")
+    parser.add_argument('--pipeline', action='store_true', help="Request the next AI command while the turn is saved")
+    parser.add_argument('--sessions', metavar='N', type=int, default=1, help="Play N independent sessions in parallel")
+    parser.add_argument('--throttle', metavar='SECONDS', type=float, default=0.0, help="Pause after each turn (default: no pause)")
+    parser.add_argument('--plan-ahead', action='store_true', help="Ask Claude for several commands per request")
+    parser.add_argument('--route-models', action='store_true', help="Use Claude Haiku for routine turns in rooms already mapped")
+    parser.add_argument('--window', metavar='TURNS', type=positive_int, default=5, help="Turns kept, with shortened game outputs, when the history reaches twice this and older turns go into a summary (default: 5)")
+    # Intermixed so the turn count can still follow the options
+    args = parser.parse_intermixed_args()
+    game_file = args.game_file
     
     if not os.path.exists(game_file):
         print(f"Error: Game file not found: {game_file}")
         sys.exit(1)
     
     # Test if dfrotz exists
-    if verbose:
-        import subprocess
-        try:
-            result = subprocess.run(['which', 'dfrotz'], capture_output=True, text=True)
-            print(f"Found dfrotz at: {result.stdout.strip()}")
-        except:
+    if args.verbose:
+        frotz_path = find_frotz()
+        if frotz_path:
+            print(f"Found dfrotz at: {frotz_path}")
+        else:
             print("Warning: Could not verify dfrotz installation")
     
+    if args.sessions > 1:
+        play_many(
+            game_file,
+            args.sessions,
+            save_file=args.save_file,
+            max_turns=args.max_turns,
+            verbose=args.verbose,
+            auto_save=args.auto_save,
+            use_ollama=args.use_ollama,
+            ollama_model=args.ollama_model,
+            ollama_url=args.ollama_url,
+            pipeline=args.pipeline,
+            throttle=args.throttle,
+            plan_ahead=args.plan_ahead,
+            window=args.window,
+            route_models=args.route_models
+        )
+        return
+    
     player = ZorkPlayer(
         game_file, 
-        max_turns=max_turns, 
-        verbose=verbose,
-        save_file=save_file,
-        auto_save=auto_save,
-        use_ollama=use_ollama,
-        ollama_model=ollama_model,
-        ollama_url=ollama_url
+        max_turns=args.max_turns, 
+        verbose=args.verbose,
+        save_file=args.save_file,
+        auto_save=args.auto_save,
+        use_ollama=args.use_ollama,
+        ollama_model=args.ollama_model,
+        ollama_url=args.ollama_url,
+        pipeline=args.pipeline,
+        throttle=args.throttle,
+        plan_ahead=args.plan_ahead,
+        window=args.window,
+        route_models=args.route_models
     )
     player.play()
 